@@ -18,6 +18,8 @@ set BUCKET_NAME=hoda2-ibd-sample-cases-us-west-2
 set PYTHON_SCRIPT_PATH=C:\Scripts\user_assignment_script.py
 set COMPLETION_SYNC_SCRIPT=C:\Scripts\completion_sync.py
 set PYTHON_EXE=C:\MiniConda\miniconda3\python.exe
+REM This Python needs boto3/botocore 1.35 or newer - the S3 folder claim uses a
+REM conditional PUT (IfNoneMatch), older botocore rejects every claim
 
 REM Get the current username
 set USERNAME=%USERNAME%
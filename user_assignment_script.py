@@ -1,19 +1,86 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import sys
 import json
-import yaml
+import logging
+import tempfile
+import threading
+import time
 from pathlib import Path
 from datetime import datetime
-import boto3
-from botocore.exceptions import ClientError, NoCredentialsError
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# boto3/botocore and yaml are imported inside the functions that use them;
+# they are slow to import and not needed on the mount-only or fast-failure paths
+
+log = logging.getLogger('user_assign')
+
+# Fixed locations on the AppStream image; APPSTREAM_HOME moves the local user homes
+# (e.g. to a scratch directory when testing off the image)
+MOUNT_ROOT = Path("C:/s3_bucket/ibd_root")
+APPSTREAM_ROOT = Path(os.environ.get('APPSTREAM_HOME', "C:/AppStreamUsers"))
+PREP_SEG_YAML = Path("C:/Scripts/ibd_labeling_local_1-main/prep_seg.yaml")
+
+# Per-user state kept between runs (validation markers, caches)
+CACHE_DIR = Path(os.environ.get('LOCALAPPDATA', tempfile.gettempdir())) / "user_assign"
+
+def _env_int(name, default, minimum=1):
+    """Integer setting from the environment; default when unset or not a number, at least minimum"""
+    try:
+        value = int(os.environ.get(name, default))
+    except ValueError:
+        value = default
+    return max(minimum, value)
+
+# Upper bound on concurrent S3 ownership checks
+S3_MAX_WORKERS = 32
+
+# Concurrent S3 GETs (files and their parts) in sync_s3_to_local (override with S3_DL_CONCURRENCY)
+S3_DOWNLOAD_WORKERS = _env_int('S3_DL_CONCURRENCY', 64)
+
+# Objects below this size are fetched with one GET into memory instead of the transfer manager
+SMALL_OBJECT_BYTES = 1024 * 1024
+
+# Tries per small-object GET when the body stream breaks mid-read (botocore retries only the request)
+SMALL_OBJECT_ATTEMPTS = 3
+
+# Shared client connection pool; never smaller than the thread pools using it at once (the
+# sync runs small and large downloads side by side), otherwise workers queue for a connection
+S3_POOL_CONNECTIONS = max(128, 2 * S3_DOWNLOAD_WORKERS)
+
+# On-disk copy of the S3 user folder list, reused for this many seconds
+FOLDER_CACHE_FILE = CACHE_DIR / "folders.json"
+FOLDER_CACHE_TTL = 300
+
+# Sync loops report progress every N files instead of printing each file
+PROGRESS_EVERY = 100
+
+# Copy threads for robocopy in mount -> local syncs
+ROBOCOPY_THREADS = 16
+
+# Seconds before a stuck robocopy is abandoned for the Python copy
+ROBOCOPY_TIMEOUT = 30 * 60
+
+# Output directory keys replaced in prep_seg.yaml
+OUTPUT_DIR_KEYS = ['output_directory', 'output_dir', 'outputDirectory', 'output_path', 'outputPath']
+# An entry is its key line plus any indented or "- " lines after it (block scalar / list value)
+_OUTPUT_DIR_LINE_RE = re.compile(
+    r'^(?:' + '|'.join(OUTPUT_DIR_KEYS) + r')[ \t]*:.*\n?(?:(?:[ \t]+|-(?=[ \t]|$)).*\n?)*', re.M
+)
+
+# user{i} folder names; [0-9] rather than \d so non-ASCII digits never reach int()
+_USER_RE = re.compile(r'user[0-9]+')
 
 def test_s3_comprehensive_access(s3_client, bucket_name):
     """
     Comprehensive S3 access test including read, write, list, and delete operations
     """
-    print("[*] Running comprehensive S3 access tests...")
+    from botocore.exceptions import ClientError, NoCredentialsError
+    
+    log.info("[*] Running comprehensive S3 access tests...")
     
     test_results = {
         'bucket_access': False,
@@ -23,28 +90,31 @@ def test_s3_comprehensive_access(s3_client, bucket_name):
         'delete_permissions': False
     }
     
-    test_key = f"connection_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-    test_content = f"S3 Connection test from {get_current_username()} at {datetime.now().isoformat()}"
+    # One timestamp for both the key and the content
+    now = datetime.now()
+    test_key = f"connection_test_{now.strftime('%Y%m%d_%H%M%S')}.txt"
+    test_content = f"S3 Connection test from {get_current_username()} at {now.isoformat()}"
+    test_key_deleted = False
     
     try:
         # Test 1: Bucket access
-        print("  [*] Testing bucket access...")
+        log.info("  [*] Testing bucket access...")
         s3_client.head_bucket(Bucket=bucket_name)
         test_results['bucket_access'] = True
-        print("  [+] Bucket access: PASSED")
+        log.info("  [+] Bucket access: PASSED")
         
         # Test 2: List permissions
-        print("  [*] Testing list permissions...")
+        log.info("  [*] Testing list permissions...")
         response = s3_client.list_objects_v2(
             Bucket=bucket_name, 
             Prefix='ibd_root/', 
             MaxKeys=1
         )
         test_results['list_permissions'] = True
-        print("  [+] List permissions: PASSED")
+        log.info("  [+] List permissions: PASSED")
         
         # Test 3: Write permissions
-        print("  [*] Testing write permissions...")
+        log.info("  [*] Testing write permissions...")
         s3_client.put_object(
             Bucket=bucket_name,
             Key=test_key,
@@ -52,112 +122,139 @@ def test_s3_comprehensive_access(s3_client, bucket_name):
             ContentType='text/plain'
         )
         test_results['write_permissions'] = True
-        print("  [+] Write permissions: PASSED")
+        log.info("  [+] Write permissions: PASSED")
         
         # Test 4: Read permissions
-        print("  [*] Testing read permissions...")
+        log.info("  [*] Testing read permissions...")
         response = s3_client.get_object(Bucket=bucket_name, Key=test_key)
         retrieved_content = response['Body'].read().decode('utf-8')
         if retrieved_content == test_content:
             test_results['read_permissions'] = True
-            print("  [+] Read permissions: PASSED")
+            log.info("  [+] Read permissions: PASSED")
         else:
-            print("  [!] Read permissions: FAILED (content mismatch)")
+            log.info("  [!] Read permissions: FAILED (content mismatch)")
         
         # Test 5: Delete permissions
-        print("  [*] Testing delete permissions...")
+        log.info("  [*] Testing delete permissions...")
         s3_client.delete_object(Bucket=bucket_name, Key=test_key)
+        test_key_deleted = True
         test_results['delete_permissions'] = True
-        print("  [+] Delete permissions: PASSED")
+        log.info("  [+] Delete permissions: PASSED")
         
     except ClientError as e:
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
         
         if error_code == 'AccessDenied':
-            print(f"  [X] Access denied: {error_message}")
-            print("      Check IAM role permissions for S3 operations")
+            log.info(f"  [X] Access denied: {error_message}")
+            log.info("      Check IAM role permissions for S3 operations")
         elif error_code == 'NoSuchBucket':
-            print(f"  [X] Bucket not found: {bucket_name}")
-            print("      Verify bucket name and region")
+            log.info(f"  [X] Bucket not found: {bucket_name}")
+            log.info("      Verify bucket name and region")
         elif error_code == 'InvalidBucketName':
-            print(f"  [X] Invalid bucket name: {bucket_name}")
+            log.info(f"  [X] Invalid bucket name: {bucket_name}")
         else:
-            print(f"  [X] S3 Client Error: {error_code} - {error_message}")
+            log.info(f"  [X] S3 Client Error: {error_code} - {error_message}")
             
     except NoCredentialsError:
-        print("  [X] No AWS credentials found")
-        print("      Check IAM role attachment or credential configuration")
+        log.info("  [X] No AWS credentials found")
+        log.info("      Check IAM role attachment or credential configuration")
         
     except Exception as e:
-        print(f"  [X] Unexpected error during S3 tests: {str(e)}")
+        log.info(f"  [X] Unexpected error during S3 tests: {str(e)}")
     
-    # Clean up test file if it still exists
-    try:
-        s3_client.delete_object(Bucket=bucket_name, Key=test_key)
-    except:
-        pass  # Ignore cleanup errors
+    # Clean up test file if Test 5 did not already delete it
+    if not test_key_deleted:
+        try:
+            s3_client.delete_object(Bucket=bucket_name, Key=test_key)
+        except:
+            pass  # Ignore cleanup errors
     
     # Summary
     passed_tests = sum(test_results.values())
     total_tests = len(test_results)
     
-    print(f"\n[*] S3 Test Results: {passed_tests}/{total_tests} tests passed")
+    log.info(f"\n[*] S3 Test Results: {passed_tests}/{total_tests} tests passed")
     
     if passed_tests == total_tests:
-        print("[+] All S3 tests PASSED - Full S3 functionality available")
+        log.info("[+] All S3 tests PASSED - Full S3 functionality available")
         return True
     else:
-        print(f"[!] {total_tests - passed_tests} S3 tests FAILED")
+        log.info(f"[!] {total_tests - passed_tests} S3 tests FAILED")
         for test_name, result in test_results.items():
             status = "PASSED" if result else "FAILED"
-            print(f"    {test_name}: {status}")
+            log.info(f"    {test_name}: {status}")
         return False
 
+def _is_user_folder(name):
+    """True for user{i} folder names"""
+    return _USER_RE.fullmatch(name) is not None
+
+def _user_folder_index(name):
+    """Numeric sort key for a name already accepted by _is_user_folder"""
+    # Fixed 'user' prefix, so a slice is enough - no second regex match per comparison
+    return int(name[4:])
+
+def list_ibd_root_folders_s3(bucket_name, s3_client):
+    """
+    List the folder names directly under ibd_root/ using only CommonPrefixes
+    
+    With Delimiter='/' S3 rolls everything below each folder into one prefix, so the cost
+    does not depend on how many files the folders contain
+    """
+    folder_names = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    pages = paginator.paginate(
+        Bucket=bucket_name,
+        Prefix='ibd_root/',
+        Delimiter='/',
+        PaginationConfig={'PageSize': 1000}
+    )
+    for page in pages:
+        # Contents only holds objects stored directly in ibd_root/, never folder contents - ignored
+        for prefix in page.get('CommonPrefixes', []):
+            folder_names.append(prefix['Prefix'][len('ibd_root/'):].rstrip('/'))
+    return folder_names
+
 def validate_s3_bucket_structure(s3_client, bucket_name):
     """
     Validate that the S3 bucket has the expected structure for user folders
     """
-    print("[*] Validating S3 bucket structure...")
+    log.info("[*] Validating S3 bucket structure...")
     
     try:
         # Check for ibd_root/ prefix
-        response = s3_client.list_objects_v2(
-            Bucket=bucket_name,
-            Prefix='ibd_root/',
-            Delimiter='/',
-            MaxKeys=10
-        )
+        folder_names = list_ibd_root_folders_s3(bucket_name, s3_client)
         
-        if 'CommonPrefixes' not in response:
-            print("[!] No folders found under ibd_root/ - this may be expected for a new bucket")
+        if not folder_names:
+            log.info("[!] No folders found under ibd_root/ - this may be expected for a new bucket")
             return True
         
-        folder_count = len(response['CommonPrefixes'])
-        print(f"[+] Found {folder_count} folders under ibd_root/")
+        log.info(f"[+] Found {len(folder_names)} folders under ibd_root/")
         
         # Check for user{i} pattern
         user_folders = []
-        for prefix in response['CommonPrefixes']:
-            folder_name = prefix['Prefix'].replace('ibd_root/', '').rstrip('/')
-            if folder_name.startswith('user') and folder_name[4:].isdigit():
+        for folder_name in folder_names:
+            if _is_user_folder(folder_name):
                 user_folders.append(folder_name)
         
         if user_folders:
-            print(f"[+] Found {len(user_folders)} user folders: {sorted(user_folders, key=lambda x: int(x[4:]))}")
+            log.info(f"[+] Found {len(user_folders)} user folders: {sorted(user_folders, key=_user_folder_index)}")
         else:
-            print("[!] No user{i} folders found - you may need to create them")
+            log.info("[!] No user{i} folders found - you may need to create them")
             
         return True
         
     except Exception as e:
-        print(f"[X] Error validating bucket structure: {e}")
+        log.info(f"[X] Error validating bucket structure: {e}")
         return False
 
 def enhanced_error_handling_s3_operations(s3_client, bucket_name, operation, **kwargs):
     """
     Wrapper function with enhanced error handling for S3 operations
     """
+    from botocore.exceptions import ClientError, NoCredentialsError
+    
     try:
         if operation == 'list_objects':
             return s3_client.list_objects_v2(Bucket=bucket_name, **kwargs)
@@ -178,171 +275,341 @@ def enhanced_error_handling_s3_operations(s3_client, bucket_name, operation, **k
         
         # Specific error handling
         if error_code == 'AccessDenied':
-            print(f"[X] Access denied for {operation}: {error_message}")
-            print("    Required permissions may be missing from IAM role")
+            log.info(f"[X] Access denied for {operation}: {error_message}")
+            log.info("    Required permissions may be missing from IAM role")
         elif error_code == 'NoSuchKey':
-            print(f"[X] Object not found for {operation}: {kwargs.get('Key', 'unknown key')}")
+            log.info(f"[X] Object not found for {operation}: {kwargs.get('Key', 'unknown key')}")
         elif error_code == 'NoSuchBucket':
-            print(f"[X] Bucket not found: {bucket_name}")
+            log.info(f"[X] Bucket not found: {bucket_name}")
         elif error_code == 'InvalidBucketName':
-            print(f"[X] Invalid bucket name: {bucket_name}")
+            log.info(f"[X] Invalid bucket name: {bucket_name}")
         elif error_code == 'BucketRegionError':
-            print(f"[X] Bucket region error - check if bucket is in us-west-2")
+            log.info(f"[X] Bucket region error - check if bucket is in us-west-2")
         elif error_code == 'RequestTimeTooSkewed':
-            print(f"[X] System time is skewed - check system clock")
+            log.info(f"[X] System time is skewed - check system clock")
+        elif error_code in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            log.info(f"[*] Conditional {operation} rejected - {kwargs.get('Key', 'unknown key')} already exists")
         else:
-            print(f"[X] S3 {operation} failed: {error_code} - {error_message}")
+            log.info(f"[X] S3 {operation} failed: {error_code} - {error_message}")
         
         raise  # Re-raise the exception
         
     except NoCredentialsError:
-        print(f"[X] No credentials available for {operation}")
-        print("    Check IAM role attachment or AWS credential configuration")
+        log.info(f"[X] No credentials available for {operation}")
+        log.info("    Check IAM role attachment or AWS credential configuration")
         raise
         
     except Exception as e:
-        print(f"[X] Unexpected error in {operation}: {str(e)}")
+        log.info(f"[X] Unexpected error in {operation}: {str(e)}")
         raise
 
+@lru_cache(maxsize=1)
 def get_current_username():
-    """Get the current username from various sources"""
+    """Get the current username from various sources (cached, stable for the process)"""
     username = (os.environ.get('USERNAME') or 
                os.environ.get('USER') or 
                os.environ.get('APPSTREAM_USER') or
                'unknown_user')
     return username.lower()
 
+# S3 clients by region, built once per process (boto3 clients are thread-safe)
+_s3_clients = {}
+
+def get_s3_client(region):
+    """Return the process-wide S3 client for region, creating it on first use"""
+    s3_client = _s3_clients.get(region)
+    if s3_client is None:
+        import boto3
+        from botocore.config import Config
+        
+        # Adaptive retries rate-limit the client under throttling instead of retry storms;
+        # keepalive and a pool sized for the thread pools avoid reconnecting for every
+        # concurrent request. Fast failure on an unreachable S3 is the probe client's job,
+        # so reads get enough slack for large ranged GETs on a busy link.
+        s3_config = Config(
+            region_name=region,
+            retries={'max_attempts': 10, 'mode': 'adaptive'},
+            connect_timeout=5,
+            read_timeout=60,
+            tcp_keepalive=True,
+            max_pool_connections=S3_POOL_CONNECTIONS
+        )
+        s3_client = boto3.client('s3', config=s3_config)
+        _s3_clients[region] = s3_client
+    return s3_client
+
+def get_s3_probe_client(region):
+    """Separate short-fuse S3 client for the reachability check - 2s timeouts, no retries"""
+    import boto3
+    from botocore.config import Config
+    
+    probe_config = Config(
+        region_name=region,
+        retries={'max_attempts': 1, 'mode': 'standard'},
+        connect_timeout=2,
+        read_timeout=2
+    )
+    return boto3.client('s3', config=probe_config)
+
+def s3_validation_marker(bucket_name, current_username):
+    """Marker file recording that S3 access was already validated for this bucket and user"""
+    return CACHE_DIR / f"s3_validated_{bucket_name}_{current_username}"
+
+@lru_cache(maxsize=4)
 def initialize_s3_client(bucket_name):
-    """Enhanced S3 client initialization with comprehensive testing"""
+    """
+    Enhanced S3 client initialization (cached per bucket, checks run once per process)
+    
+    Every run checks reachability with a short-fuse head_bucket. The full put/get/delete
+    test only runs with S3_SELFTEST=1, and only until it has passed once (marker file).
+    """
     # Check environment variable from batch file
     skip_s3 = os.environ.get('SKIP_S3_OPERATIONS', '0')
     current_username = get_current_username()
     
     if skip_s3 == '1' or current_username == 'imagebuildertest':
-        print("[*] Test environment detected - skipping S3 operations")
+        log.info("[*] Test environment detected - skipping S3 operations")
         return None
     if os.environ.get('USERNAME') == 'ImageBuilderTest':
-        print("[*] Image building mode - skipping S3 operations")
+        log.info("[*] Image building mode - skipping S3 operations")
         return None
     
+    # Only pay the botocore import cost once S3 is actually going to be used
+    from botocore.exceptions import ClientError, NoCredentialsError
+    
     try:
         # Normal IAM role logic for production
-        print("[*] Initializing S3 client with AWS default credential chain...")
+        log.info("[*] Initializing S3 client with AWS default credential chain...")
         
         # Get region from environment or default
         region = os.environ.get('AWS_DEFAULT_REGION', 'us-west-2')
-        print(f"[*] Using AWS region: {region}")
+        log.info(f"[*] Using AWS region: {region}")
+        
+        s3_client = get_s3_client(region)
+        
+        # Reachability check on every run - an unreachable S3 fails within seconds instead
+        # of waiting out the main client's retries, so the mount fallback starts early
+        log.info("[*] Testing basic S3 connection...")
+        try:
+            get_s3_probe_client(region).head_bucket(Bucket=bucket_name)
+            log.info(f"[+] Basic S3 connection established for bucket: {bucket_name}")
+        except ClientError as e:
+            # HEAD has no error body, a 403 only says ListBucket is missing on the bucket
+            # itself - the bucket exists, so go ahead and let listing report real problems
+            if e.response['Error']['Code'] not in ('403', 'AccessDenied'):
+                raise
+            log.info(f"[!] head_bucket denied for {bucket_name} - bucket exists, continuing with S3")
+            return s3_client
         
-        s3_client = boto3.client('s3', region_name=region)
+        if os.environ.get('S3_SELFTEST', '0') != '1':
+            return s3_client
         
-        # Basic connection test
-        print("[*] Testing basic S3 connection...")
-        s3_client.head_bucket(Bucket=bucket_name)
-        print(f"[+] Basic S3 connection established for bucket: {bucket_name}")
+        # The marker only records a passed self-test, so it is not repeated on every login
+        validation_marker = s3_validation_marker(bucket_name, current_username)
+        if validation_marker.exists():
+            log.info("[+] S3 self-test passed on an earlier run - skipping it")
+            return s3_client
         
         # Run comprehensive tests
-        if test_s3_comprehensive_access(s3_client, bucket_name):
-            print("[+] S3 client fully validated and ready")
-            
-            # Validate bucket structure
-            validate_s3_bucket_structure(s3_client, bucket_name)
-            
-            return s3_client
-        else:
-            print("[!] S3 comprehensive tests failed - will attempt mount fallback")
+        if not test_s3_comprehensive_access(s3_client, bucket_name):
+            log.info("[!] S3 comprehensive tests failed - will attempt mount fallback")
             return None
+        log.info("[+] S3 client fully validated and ready")
+        
+        # Validate bucket structure
+        validate_s3_bucket_structure(s3_client, bucket_name)
+        
+        try:
+            ensure_dir(validation_marker.parent)
+            validation_marker.write_bytes(datetime.now().isoformat().encode('utf-8'))
+        except OSError as e:
+            log.info(f"[!] Could not record S3 validation marker: {e}")
+        
+        return s3_client
             
     except ClientError as e:
         error_code = e.response['Error']['Code']
-        print(f"[X] S3 client initialization failed: {error_code}")
+        log.info(f"[X] S3 client initialization failed: {error_code}")
         
         if error_code == 'AccessDenied':
-            print("[*] Access denied - check IAM role permissions")
-            print("[*] Required permissions: s3:GetObject, s3:PutObject, s3:DeleteObject, s3:ListBucket")
+            log.info("[*] Access denied - check IAM role permissions")
+            log.info("[*] Required permissions: s3:GetObject, s3:PutObject, s3:DeleteObject, s3:ListBucket")
         elif error_code == 'NoSuchBucket':
-            print(f"[*] Bucket {bucket_name} not found - check bucket name and region")
+            log.info(f"[*] Bucket {bucket_name} not found - check bucket name and region")
         
-        print("[*] Will attempt to use mounted S3 data instead")
+        log.info("[*] Will attempt to use mounted S3 data instead")
         return None
         
     except NoCredentialsError:
-        print("[X] No AWS credentials found")
-        print("[*] This is expected in test environments")
-        print("[*] Will attempt to use mounted S3 data instead")
+        log.info("[X] No AWS credentials found")
+        log.info("[*] This is expected in test environments")
+        log.info("[*] Will attempt to use mounted S3 data instead")
         return None
         
     except Exception as e:
-        print(f"[X] S3 connection failed: {e}")
-        print("[*] Will attempt to use mounted S3 data instead")
+        log.info(f"[X] S3 connection failed: {e}")
+        log.info("[*] Will attempt to use mounted S3 data instead")
         return None
 
 def check_s3_mount_available():
     """
     Check if S3 bucket is mounted at C:/s3_bucket/ibd_root
     """
-    mount_path = Path("C:/s3_bucket/ibd_root")
-    if mount_path.exists() and mount_path.is_dir():
-        # Check if it has expected structure
-        if any(mount_path.iterdir()):  # Not empty
-            print(f"[+] S3 mount available at: {mount_path}")
+    mount_path = MOUNT_ROOT
+    # is_dir() is False for a missing path, so no separate exists() lookup
+    if mount_path.is_dir():
+        # Check if it has expected structure - scandir stops at the first entry,
+        # iterdir would list the whole directory first
+        with os.scandir(mount_path) as entries:
+            has_entries = next(entries, None) is not None
+        if has_entries:  # Not empty
+            log.info(f"[+] S3 mount available at: {mount_path}")
             return mount_path
     
-    print(f"[!] S3 mount not available at: {mount_path}")
+    log.info(f"[!] S3 mount not available at: {mount_path}")
     return None
 
 def list_user_folders_s3(bucket_name, s3_client):
-    """List all user{i} folders in ibd_root/ from S3 with enhanced error handling"""
+    """
+    List all user{i} folders in ibd_root/ from S3 with enhanced error handling
+    """
+    from botocore.exceptions import ClientError
+    
     try:
-        print("[*] Scanning S3 ibd_root/ for user folders...")
-        
-        response = enhanced_error_handling_s3_operations(
-            s3_client, bucket_name, 'list_objects',
-            Prefix='ibd_root/',
-            Delimiter='/'
-        )
+        log.info("[*] Scanning S3 ibd_root/ for user folders...")
         
+        # Paginated, so buckets with more than 1000 folders are not silently truncated
         user_folders = []
-        if 'CommonPrefixes' in response:
-            for prefix in response['CommonPrefixes']:
-                folder_name = prefix['Prefix'].replace('ibd_root/', '').rstrip('/')
-                if folder_name.startswith('user') and folder_name[4:].isdigit():
-                    user_folders.append(folder_name)
-        
-        user_folders.sort(key=lambda x: int(x[4:]))
-        print(f"[+] Found {len(user_folders)} user folders in S3: {user_folders}")
+        for folder_name in list_ibd_root_folders_s3(bucket_name, s3_client):
+            if _is_user_folder(folder_name):
+                user_folders.append(folder_name)
+        
+        user_folders.sort(key=_user_folder_index)
+        log.info(f"[+] Found {len(user_folders)} user folders in S3: {user_folders}")
         return user_folders
         
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'AccessDenied':
-            print("[X] Access denied when listing S3 folders - check s3:ListBucket permission")
+            log.info("[X] Access denied when listing S3 folders - check s3:ListBucket permission")
         else:
-            print(f"[X] Error listing S3 user folders: {error_code}")
+            log.info(f"[X] Error listing S3 user folders: {error_code}")
         return []
     except Exception as e:
-        print(f"[X] Unexpected error listing S3 user folders: {e}")
+        log.info(f"[X] Unexpected error listing S3 user folders: {e}")
         return []
 
-def list_user_folders_mount(mount_path):
-    """List all user{i} folders from mounted S3"""
+def _json_codec():
+    """(loads, dumps) from orjson when it is installed, else the json module; dumps returns str"""
     try:
-        print(f"[*] Scanning mount {mount_path} for user folders...")
-        
-        user_folders = []
-        for item in mount_path.iterdir():
-            if item.is_dir() and item.name.startswith('user') and item.name[4:].isdigit():
-                user_folders.append(item.name)
-        
-        user_folders.sort(key=lambda x: int(x[4:]))
-        print(f"[+] Found {len(user_folders)} user folders in mount: {user_folders}")
-        return user_folders
-        
+        import orjson
+    except ImportError:
+        return json.loads, json.dumps
+    return orjson.loads, lambda obj: orjson.dumps(obj).decode('utf-8')
+
+def load_cached_user_folders(bucket_name):
+    """User folders from FOLDER_CACHE_FILE if it is fresh and for bucket_name, else None"""
+    try:
+        if FOLDER_CACHE_FILE.stat().st_mtime < time.time() - FOLDER_CACHE_TTL:
+            return None
+        json_loads, _ = _json_codec()
+        with open(FOLDER_CACHE_FILE, 'rb') as f:
+            cached = json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+    
+    # Anything but the expected shape (hand-edited, truncated, older format) is a cache miss
+    if not isinstance(cached, dict):
+        return None
+    # A different bucket means the cache belongs to another deployment - ignore it
+    if cached.get('bucket') != bucket_name:
+        return None
+    user_folders = cached.get('user_folders')
+    if not isinstance(user_folders, list) or not all(
+        isinstance(user_folder, str) and _is_user_folder(user_folder) for user_folder in user_folders
+    ):
+        return None
+    return user_folders or None
+
+def save_cached_user_folders(bucket_name, user_folders):
+    """Record the S3 user folder list for later runs (atomic replace, failures only logged)"""
+    try:
+        _, json_dumps = _json_codec()
+        ensure_dir(CACHE_DIR)
+        write_text_atomic(FOLDER_CACHE_FILE, json_dumps({'bucket': bucket_name, 'user_folders': user_folders}))
+    except OSError as e:
+        log.info(f"[!] Could not cache S3 user folder list: {e}")
+
+def probe_users_mount(mount_path, current_username):
+    """
+    Probe the mount's user{i} folders in index order, yielding ("free", folder) for each
+    available folder and finally ("mine", folder) if one is already taken by current_username
+    """
+    # One readdir gives every existing user{i} folder, so only real folders are probed
+    with os.scandir(mount_path) as entries:
+        existing_folders = [
+            entry.name for entry in entries
+            if _is_user_folder(entry.name) and entry.is_dir(follow_symlinks=False)
+        ]
+    existing_folders.sort(key=_user_folder_index)
+    
+    for user_folder in existing_folders:
+        taken_by_path = os.path.join(mount_path, user_folder, "taken_by.txt")
+        
+        # Open directly instead of exists() + read - one lookup on the mount for taken folders
+        try:
+            with open(taken_by_path, 'rb') as f:
+                taken_by_content = f.read().decode('utf-8', 'replace')
+        except FileNotFoundError:
+            yield "free", user_folder
+            continue
+        except OSError as e:
+            # Unreadable marker (locked, EIO on the mount, ...) - treat as taken, keep going
+            log.info(f"[!] Error checking {user_folder}: {e}")
+            continue
+        
+        taken_by_user = taken_by_content.split('\n', 1)[0].strip().lower()
+        if taken_by_user == current_username:
+            yield "mine", user_folder
+            return
+        log.info(f"[*] {user_folder} is taken by: {taken_by_user}")
+
+def discover_user_mount(mount_path, current_username):
+    """
+    Read-only pass over the mount, returns (existing_folder, free_folders) without claiming anything
+    """
+    log.info(f"[*] Probing mount {mount_path} for user folders...")
+    
+    free_folders = []
+    try:
+        for status, user_folder in probe_users_mount(mount_path, current_username):
+            if status == "mine":
+                return user_folder, free_folders
+            free_folders.append(user_folder)
     except Exception as e:
-        print(f"[X] Error listing mount user folders: {e}")
-        return []
+        log.info(f"[X] Error probing mount user folders: {e}")
+        return None, []
+    
+    return None, free_folders
+
+def assign_user_mount(mount_path, current_username):
+    """Find the current user's existing mount folder, or claim the first available one"""
+    existing_folder, free_folders = discover_user_mount(mount_path, current_username)
+    if existing_folder:
+        log.info(f"[+] Found existing assignment: {existing_folder} for {current_username}")
+        return existing_folder
+    
+    for user_folder in free_folders:
+        log.info(f"[+] Found available folder: {user_folder}")
+        if claim_user_folder_mount(mount_path, user_folder, current_username):
+            return user_folder
+    
+    return None
 
 def check_user_taken_s3(bucket_name, s3_client, user_folder):
     """Check if a user folder is taken by looking for taken_by.txt in S3 with enhanced error handling"""
+    from botocore.exceptions import ClientError
+    
     try:
         taken_by_key = f"ibd_root/{user_folder}/taken_by.txt"
         
@@ -352,117 +619,275 @@ def check_user_taken_s3(bucket_name, s3_client, user_folder):
         )
         
         taken_by_content = response['Body'].read().decode('utf-8').strip()
-        print(f"[*] {user_folder} is taken by: {taken_by_content}")
+        log.info(f"[*] {user_folder} is taken by: {taken_by_content}")
         return True, taken_by_content
         
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'NoSuchKey':
-            print(f"[*] {user_folder} is available")
+            log.info(f"[*] {user_folder} is available")
             return False, None
         elif error_code == 'AccessDenied':
-            print(f"[!] Access denied checking {user_folder} - check s3:GetObject permission")
+            log.info(f"[!] Access denied checking {user_folder} - check s3:GetObject permission")
             return True, "access_denied"
         else:
-            print(f"[!] Error checking {user_folder}: {error_code}")
+            log.info(f"[!] Error checking {user_folder}: {error_code}")
             return True, "error"
     except Exception as e:
-        print(f"[!] Unexpected error checking {user_folder}: {e}")
+        log.info(f"[!] Unexpected error checking {user_folder}: {e}")
         return True, "error"
 
-def check_user_taken_mount(mount_path, user_folder):
-    """Check if a user folder is taken by looking for taken_by.txt in mount"""
+def taken_status_from_error(user_folder, error_code):
+    """Map a head_object error on taken_by.txt to (is_taken, taken_by)"""
+    if error_code in ('404', 'NoSuchKey', 'NotFound'):
+        log.info(f"[*] {user_folder} is available")
+        return False, None
+    elif error_code in ('403', 'AccessDenied'):
+        log.info(f"[!] Access denied checking {user_folder} - check s3:GetObject permission")
+        return True, "access_denied"
+    else:
+        log.info(f"[!] Error checking {user_folder}: {error_code}")
+        return True, "error"
+
+def head_user_taken_s3(bucket_name, s3_client, user_folder):
+    """
+    Check a user folder with head_object on taken_by.txt (no body transfer)
+    
+    The owner is read from the object's taken_by metadata; markers written before
+    claims stored that metadata fall back to check_user_taken_s3 to read the body
+    """
+    from botocore.exceptions import ClientError
+    
+    taken_by_key = f"ibd_root/{user_folder}/taken_by.txt"
     try:
-        taken_by_file = mount_path / user_folder / "taken_by.txt"
-        if taken_by_file.exists():
-            taken_by_content = taken_by_file.read_text().strip()
-            print(f"[*] {user_folder} is taken by: {taken_by_content}")
-            return True, taken_by_content
-        else:
-            print(f"[*] {user_folder} is available")
-            return False, None
+        response = s3_client.head_object(Bucket=bucket_name, Key=taken_by_key)
+    except ClientError as e:
+        return taken_status_from_error(user_folder, e.response['Error']['Code'])
     except Exception as e:
-        print(f"[!] Error checking {user_folder}: {e}")
+        log.info(f"[!] Unexpected error checking {user_folder}: {e}")
         return True, "error"
+    
+    taken_by_user = response.get('Metadata', {}).get('taken_by')
+    if taken_by_user is None:
+        return check_user_taken_s3(bucket_name, s3_client, user_folder)
+    
+    log.info(f"[*] {user_folder} is taken by: {taken_by_user}")
+    return True, taken_by_user
+
+def user_folder_exists_s3(bucket_name, s3_client, user_folder):
+    """Check that ibd_root/<user_folder>/ still holds at least one object"""
+    try:
+        response = s3_client.list_objects_v2(
+            Bucket=bucket_name, Prefix=f"ibd_root/{user_folder}/", MaxKeys=1
+        )
+        return response.get('KeyCount', 0) > 0
+    except Exception as e:
+        log.info(f"[!] Error checking that {user_folder} exists: {e}")
+        return False
+
+async def check_users_taken_async(bucket_name, region, user_folders):
+    """
+    aiobotocore version of the bulk ownership check - all HEADs share one event loop
+    
+    Same results as head_user_taken_s3, including the body read for markers without metadata
+    """
+    import asyncio
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+    from botocore.exceptions import ClientError
+    
+    async def check_one(s3_client, user_folder):
+        taken_by_key = f"ibd_root/{user_folder}/taken_by.txt"
+        try:
+            response = await s3_client.head_object(Bucket=bucket_name, Key=taken_by_key)
+            taken_by_user = response.get('Metadata', {}).get('taken_by')
+            if taken_by_user is None:
+                response = await s3_client.get_object(Bucket=bucket_name, Key=taken_by_key)
+                async with response['Body'] as stream:
+                    taken_by_user = (await stream.read()).decode('utf-8').strip()
+        except ClientError as e:
+            return taken_status_from_error(user_folder, e.response['Error']['Code'])
+        except Exception as e:
+            log.info(f"[!] Unexpected error checking {user_folder}: {e}")
+            return True, "error"
+        
+        log.info(f"[*] {user_folder} is taken by: {taken_by_user}")
+        return True, taken_by_user
+    
+    config = AioConfig(max_pool_connections=S3_MAX_WORKERS)
+    async with get_session().create_client('s3', region_name=region, config=config) as s3_client:
+        results = await asyncio.gather(*(check_one(s3_client, user_folder) for user_folder in user_folders))
+    return dict(zip(user_folders, results))
+
+def check_users_taken_bulk_s3(bucket_name, s3_client, user_folders):
+    """
+    Check many user folders concurrently
+    
+    Uses aiobotocore when it is installed, otherwise a thread pool over the shared S3 client.
+    Returns {user_folder: (is_taken, taken_by)} as produced by head_user_taken_s3
+    """
+    if not user_folders:
+        return {}
+    
+    # aiobotocore is optional; without it the thread pool below does the fan-out
+    try:
+        import aiobotocore
+    except ImportError:
+        aiobotocore = None
+    
+    if aiobotocore is not None:
+        import asyncio
+        try:
+            return asyncio.run(check_users_taken_async(bucket_name, s3_client.meta.region_name, user_folders))
+        except Exception as e:
+            log.info(f"[!] Async S3 check failed ({e}) - falling back to threads")
+    
+    with ThreadPoolExecutor(max_workers=min(S3_MAX_WORKERS, len(user_folders))) as executor:
+        results = executor.map(
+            lambda user_folder: head_user_taken_s3(bucket_name, s3_client, user_folder),
+            user_folders
+        )
+        return dict(zip(user_folders, results))
+
+# O_BINARY only exists (and matters) on Windows, where it stops newline translation
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+
+def write_file_bytes(path, content):
+    """Write bytes with os.open/os.write/os.close, no buffered file object"""
+    fd = os.open(path, _WRITE_FLAGS, 0o644)
+    try:
+        # os.write may write less than asked; usually one call, loop for the rest
+        view = memoryview(content)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def ensure_dir(path):
+    """makedirs(exist_ok=True) that skips the create call when the directory is already there"""
+    # An existing directory costs one stat here instead of a failed CreateDirectory plus a stat
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+
+def write_local_taken_by(local_taken_by_file, content):
+    """Write the local taken_by.txt (bytes), creating its user folder if needed"""
+    ensure_dir(local_taken_by_file.parent)
+    write_file_bytes(local_taken_by_file, content)
 
 def claim_user_folder_s3(bucket_name, s3_client, user_folder, current_username):
     """Claim a user folder by creating taken_by.txt in S3 and locally with enhanced error handling"""
+    from botocore.exceptions import ClientError, ParamValidationError
+    
     try:
         taken_by_key = f"ibd_root/{user_folder}/taken_by.txt"
+        # Same timestamp for the S3 and local copies
+        now_iso = datetime.now().isoformat()
         # S3 version - only username
-        s3_content = f"{current_username}\nClaimed at: {datetime.now().isoformat()}"
-        
-        # Upload to S3 with enhanced error handling
-        enhanced_error_handling_s3_operations(
-            s3_client, bucket_name, 'put_object',
-            Key=taken_by_key,
-            Body=s3_content,
-            ContentType='text/plain'
-        )
-        
-        print(f"[+] Successfully claimed {user_folder} for {current_username} in S3")
-        
+        s3_content = f"{current_username}\nClaimed at: {now_iso}".encode('utf-8')
         # Local version - user folder + username
-        local_content = f"{user_folder}\n{current_username}\nClaimed at: {datetime.now().isoformat()}"
-        local_taken_by_file = Path(f"C:/AppStreamUsers/{user_folder}/taken_by.txt")
-        local_taken_by_file.parent.mkdir(parents=True, exist_ok=True)
-        local_taken_by_file.write_text(local_content)
-        
-        print(f"[+] Also saved taken_by.txt locally: {local_taken_by_file}")
+        local_content = f"{user_folder}\n{current_username}\nClaimed at: {now_iso}".encode('utf-8')
+        local_taken_by_file = APPSTREAM_ROOT / user_folder / "taken_by.txt"
+        # S3 metadata must be ASCII; for other usernames readers fall back to the object body
+        put_metadata = {'taken_by': current_username} if current_username.isascii() else {}
+        
+        # The local write runs while the S3 PUT is in flight and is undone if the claim fails
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            local_write = executor.submit(write_local_taken_by, local_taken_by_file, local_content)
+            try:
+                # Conditional PUT: only succeeds if taken_by.txt does not exist yet, so two
+                # sessions racing for the same folder cannot both claim it
+                enhanced_error_handling_s3_operations(
+                    s3_client, bucket_name, 'put_object',
+                    Key=taken_by_key,
+                    Body=s3_content,
+                    ContentType='text/plain',
+                    Metadata=put_metadata,
+                    IfNoneMatch='*'
+                )
+            except Exception:
+                if local_write.exception() is None:
+                    local_taken_by_file.unlink(missing_ok=True)
+                raise
+        
+        log.info(f"[+] Successfully claimed {user_folder} for {current_username} in S3")
+        
+        local_write.result()
+        log.info(f"[+] Also saved taken_by.txt locally: {local_taken_by_file}")
         
         return True
         
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'AccessDenied':
-            print(f"[X] Access denied claiming {user_folder} - check s3:PutObject permission")
+            log.info(f"[X] Access denied claiming {user_folder} - check s3:PutObject permission")
+        elif error_code in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            log.info(f"[!] {user_folder} was claimed by another session - trying next folder")
         else:
-            print(f"[X] Error claiming {user_folder} in S3: {error_code}")
+            log.info(f"[X] Error claiming {user_folder} in S3: {error_code}")
+        return False
+    except ParamValidationError as e:
+        # IfNoneMatch on put_object needs botocore 1.35+; older versions reject it client-side
+        log.info(f"[X] S3 claim request rejected by botocore ({e}) - boto3/botocore 1.35 or newer is required")
         return False
     except Exception as e:
-        print(f"[X] Error saving local taken_by.txt: {e}")
+        log.info(f"[X] Error saving local taken_by.txt: {e}")
         return False
 
 def claim_user_folder_mount(mount_path, user_folder, current_username):
     """Claim a user folder by creating taken_by.txt in mount and locally"""
     try:
-        # Mount version - only username
+        # Mount version - only username. The user folder itself was found by probing the
+        # mount, so no mkdir round trip is needed before writing into it.
         taken_by_file = mount_path / user_folder / "taken_by.txt"
-        taken_by_file.parent.mkdir(parents=True, exist_ok=True)
         
-        mount_content = f"{current_username}\nClaimed at: {datetime.now().isoformat()}"
-        taken_by_file.write_text(mount_content)
+        # Same timestamp for the mount and local copies
+        now_iso = datetime.now().isoformat()
+        mount_content = f"{current_username}\nClaimed at: {now_iso}".encode('utf-8')
+        write_file_bytes(taken_by_file, mount_content)
         
-        print(f"[+] Successfully claimed {user_folder} for {current_username} in mount")
+        log.info(f"[+] Successfully claimed {user_folder} for {current_username} in mount")
         
         # Local version - user folder + username
-        local_content = f"{user_folder}\n{current_username}\nClaimed at: {datetime.now().isoformat()}"
-        local_taken_by_file = Path(f"C:/AppStreamUsers/{user_folder}/taken_by.txt")
-        local_taken_by_file.parent.mkdir(parents=True, exist_ok=True)
-        local_taken_by_file.write_text(local_content)
+        local_content = f"{user_folder}\n{current_username}\nClaimed at: {now_iso}".encode('utf-8')
+        local_taken_by_file = APPSTREAM_ROOT / user_folder / "taken_by.txt"
+        write_local_taken_by(local_taken_by_file, local_content)
         
-        print(f"[+] Also saved taken_by.txt locally: {local_taken_by_file}")
+        log.info(f"[+] Also saved taken_by.txt locally: {local_taken_by_file}")
         
         return True
     except Exception as e:
-        print(f"[X] Error claiming {user_folder} in mount: {e}")
+        log.info(f"[X] Error claiming {user_folder} in mount: {e}")
         return False
 
 def sync_s3_to_local(bucket_name, s3_client, assigned_user):
     """Sync S3 user folder to local AppStreamUsers directory with enhanced error handling"""
+    from botocore.exceptions import ClientError, ReadTimeoutError, ResponseStreamingError
+    from boto3.s3.transfer import TransferConfig, create_transfer_manager
+    
     s3_prefix = f"ibd_root/{assigned_user}/"
-    local_dir = Path(f"C:/AppStreamUsers/{assigned_user}")
+    local_dir = APPSTREAM_ROOT / assigned_user
     
     try:
-        print(f"[*] Syncing S3 folder to local: {local_dir}")
-        local_dir.mkdir(parents=True, exist_ok=True)
+        log.info(f"[*] Syncing S3 folder to local: {local_dir}")
+        ensure_dir(local_dir)
         
         paginator = s3_client.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=bucket_name, Prefix=s3_prefix)
+        # s3_prefix ends in '/', so only this folder's keys are scanned (not user10/ for user1)
+        pages = paginator.paginate(
+            Bucket=bucket_name,
+            Prefix=s3_prefix,
+            PaginationConfig={'PageSize': 1000}
+        )
         
         downloaded_files = 0
         failed_files = 0
+        # Plain string paths in the per-file loop, Path arithmetic is noticeably slower here
+        local_dir_str = str(local_dir)
         
+        # Collect the objects to fetch first, then download them in parallel
+        downloads = []
+        # Each parent directory is created once, not once per file inside it
+        created_dirs = {local_dir_str}
         for page in pages:
             if 'Contents' not in page:
                 continue
@@ -473,385 +898,602 @@ def sync_s3_to_local(bucket_name, s3_client, assigned_user):
                     continue
                 
                 relative_path = s3_key[len(s3_prefix):]
-                local_file_path = local_dir / relative_path
-                local_file_path.parent.mkdir(parents=True, exist_ok=True)
-                
+                local_file_path = os.path.join(local_dir_str, relative_path)
+                parent_dir = os.path.dirname(local_file_path)
+                if parent_dir not in created_dirs:
+                    os.makedirs(parent_dir, exist_ok=True)
+                    created_dirs.add(parent_dir)
+                downloads.append((s3_key, relative_path, local_file_path, obj['Size']))
+        
+        def download_small(s3_key, local_file_path):
+            # Whole body in memory, then a single os.write - no temp file and rename per object.
+            # A connection dropped while reading the body is retried here, like the transfer
+            # manager does for large files
+            for attempt in range(1, SMALL_OBJECT_ATTEMPTS + 1):
+                try:
+                    response = s3_client.get_object(Bucket=bucket_name, Key=s3_key)
+                    body = response['Body'].read()
+                    break
+                except (ResponseStreamingError, ReadTimeoutError):
+                    if attempt == SMALL_OBJECT_ATTEMPTS:
+                        raise
+            write_file_bytes(local_file_path, body)
+        
+        # One transfer manager for the whole folder: its thread pool is shared by every
+        # file, and large files (DICOMs, segmentation volumes) are split into 8 MB ranged
+        # GETs on the same pool
+        transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=S3_DOWNLOAD_WORKERS,
+            max_io_queue=1000,
+            use_threads=True
+        )
+        
+        # Small objects (most of a user home) skip the transfer machinery and go through a
+        # plain thread pool of single GETs; the client pool has room for both
+        with create_transfer_manager(s3_client, transfer_config) as transfer_manager, \
+                ThreadPoolExecutor(max_workers=S3_DOWNLOAD_WORKERS) as small_executor:
+            futures = []
+            for s3_key, relative_path, local_file_path, size in downloads:
+                if size < SMALL_OBJECT_BYTES:
+                    future = small_executor.submit(download_small, s3_key, local_file_path)
+                else:
+                    future = transfer_manager.download(bucket_name, s3_key, local_file_path)
+                futures.append((future, relative_path))
+            
+            # Results are counted on this thread only, a failed file never aborts the others
+            for future, relative_path in futures:
                 try:
-                    s3_client.download_file(bucket_name, s3_key, str(local_file_path))
+                    future.result()
                     downloaded_files += 1
-                    print(f"  [+] Downloaded: {relative_path}")
+                    if downloaded_files % PROGRESS_EVERY == 0:
+                        log.info(f"  [+] {downloaded_files} files downloaded...")
                 except ClientError as e:
                     error_code = e.response['Error']['Code']
                     if error_code == 'AccessDenied':
-                        print(f"  [X] Access denied downloading: {relative_path}")
+                        log.info(f"  [X] Access denied downloading: {relative_path}")
                     else:
-                        print(f"  [X] Failed to download {relative_path}: {error_code}")
+                        log.info(f"  [X] Failed to download {relative_path}: {error_code}")
                     failed_files += 1
                 except Exception as e:
-                    print(f"  [X] Failed to download {relative_path}: {e}")
+                    log.info(f"  [X] Failed to download {relative_path}: {e}")
                     failed_files += 1
         
         if failed_files > 0:
-            print(f"[!] S3 sync completed with issues: {downloaded_files} files downloaded, {failed_files} files failed")
+            log.info(f"[!] S3 sync completed with issues: {downloaded_files} files downloaded, {failed_files} files failed")
         else:
-            print(f"[+] S3 sync completed successfully: {downloaded_files} files")
+            log.info(f"[+] S3 sync completed successfully: {downloaded_files} files")
         
         return local_dir
         
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'AccessDenied':
-            print(f"[X] Access denied syncing from S3 - check s3:GetObject and s3:ListBucket permissions")
+            log.info(f"[X] Access denied syncing from S3 - check s3:GetObject and s3:ListBucket permissions")
         elif error_code == 'NoSuchBucket':
-            print(f"[X] S3 bucket {bucket_name} not found")
+            log.info(f"[X] S3 bucket {bucket_name} not found")
         else:
-            print(f"[X] S3 sync error: {error_code}")
+            log.info(f"[X] S3 sync error: {error_code}")
         return local_dir
     except Exception as e:
-        print(f"[X] Error syncing from S3: {e}")
+        log.info(f"[X] Error syncing from S3: {e}")
         return local_dir
 
+def copy_tree_robocopy(source_dir, local_dir):
+    """
+    Copy source_dir into local_dir with multi-threaded robocopy, skipping taken_by.txt
+    
+    Returns True on success, False if robocopy is unavailable or reported a failure
+    """
+    import shutil
+    import subprocess
+    
+    robocopy = shutil.which('robocopy')
+    if not robocopy:
+        return False
+    
+    try:
+        # robocopy writes in the OEM code page; undecodable bytes in a path must not turn a
+        # finished copy into an exception that also skips the Python fallback
+        result = subprocess.run(
+            [robocopy, str(source_dir), str(local_dir), '/E', f'/MT:{ROBOCOPY_THREADS}',
+             '/XF', 'taken_by.txt', '/NFL', '/NDL', '/NJH', '/NJS', '/NP', '/R:1', '/W:1'],
+            capture_output=True, text=True, errors='replace', check=False,
+            timeout=ROBOCOPY_TIMEOUT
+        )
+    except subprocess.TimeoutExpired:
+        log.info(f"[!] robocopy did not finish within {ROBOCOPY_TIMEOUT}s")
+        return False
+    
+    # robocopy exit codes 0-7 are success variants, 8 and above mean some copies failed
+    if result.returncode >= 8:
+        log.info(f"[!] robocopy failed with exit code {result.returncode}: {result.stdout.strip()}")
+        return False
+    return True
+
 def sync_mount_to_local_from_path(source_dir, assigned_user_folder):
     """Sync specific mount path to local AppStreamUsers directory"""
     import shutil
     
     # Use the assigned_user_folder name directly (e.g., "user1")
-    local_dir = Path(f"C:/AppStreamUsers/{assigned_user_folder}")
+    local_dir = APPSTREAM_ROOT / assigned_user_folder
     
     try:
-        print(f"[*] Syncing mount path to local: {source_dir} -> {local_dir}")
-        local_dir.mkdir(parents=True, exist_ok=True)
+        log.info(f"[*] Syncing mount path to local: {source_dir} -> {local_dir}")
+        ensure_dir(local_dir)
         
         if not source_dir.exists():
-            print(f"[!] Source directory doesn't exist: {source_dir}")
+            log.info(f"[!] Source directory doesn't exist: {source_dir}")
+            return local_dir
+        
+        if copy_tree_robocopy(source_dir, local_dir):
+            log.info("[+] Mount path sync completed with robocopy")
             return local_dir
         
+        # Python fallback when robocopy is unavailable or failed. copytree walks with scandir
+        # and copy2 uses the OS fast paths (CopyFileW / sendfile) while keeping mtimes.
+        # Hard links are deliberately not used even on the same volume: the local home is
+        # edited in place, which would write straight through to the source folder.
         copied_files = 0
-        for item in source_dir.rglob("*"):
-            if item.is_file() and item.name != "taken_by.txt":
-                relative_path = item.relative_to(source_dir)
-                local_file_path = local_dir / relative_path
-                local_file_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                shutil.copy2(item, local_file_path)
-                copied_files += 1
-                print(f"  [+] Copied: {relative_path}")
         
-        print(f"[+] Mount path sync completed: {copied_files} files")
+        def copy_file(src, dst):
+            nonlocal copied_files
+            shutil.copy2(src, dst)
+            copied_files += 1
+            if copied_files % PROGRESS_EVERY == 0:
+                log.info(f"  [+] {copied_files} files copied...")
+        
+        shutil.copytree(source_dir, local_dir, dirs_exist_ok=True, copy_function=copy_file,
+                        ignore=shutil.ignore_patterns("taken_by.txt"))
+        
+        log.info(f"[+] Mount path sync completed: {copied_files} files")
         return local_dir
         
     except Exception as e:
-        print(f"[X] Error syncing from mount path: {e}")
+        log.info(f"[X] Error syncing from mount path: {e}")
         return local_dir
 
+def write_text_atomic(path, text):
+    """Write text to path via a temp file in the same directory and os.replace"""
+    with tempfile.NamedTemporaryFile('w', dir=path.parent, suffix='.tmp', delete=False) as tmp:
+        tmp.write(text)
+    try:
+        os.replace(tmp.name, path)
+    except OSError:
+        # Don't leave stray .tmp files next to the config if the swap fails
+        os.unlink(tmp.name)
+        raise
+
 def update_prep_seg_yaml(assigned_user_folder):
     """Update prep_seg.yaml file to set output directory to user's folder"""
-    yaml_file = Path("C:/Scripts/ibd_labeling_local_1-main/prep_seg.yaml")
+    yaml_file = PREP_SEG_YAML
     
     try:
-        if not yaml_file.exists():
-            print(f"[!] prep_seg.yaml not found at {yaml_file}")
+        # Read straight away rather than stat first; a missing file is the rare case
+        try:
+            text = yaml_file.read_text()
+        except FileNotFoundError:
+            log.info(f"[!] prep_seg.yaml not found at {yaml_file}")
             return False
         
-        with open(yaml_file, 'r') as f:
-            yaml_data = yaml.safe_load(f)
-        
         # Use the assigned_user_folder (e.g., "user1") directly
-        new_output_dir = f"C:/AppStreamUsers/{assigned_user_folder}"
+        new_output_dir = (APPSTREAM_ROOT / assigned_user_folder).as_posix()
         
-        # Remove existing output directory entries
-        output_keys = ['output_directory', 'output_dir', 'outputDirectory', 'output_path', 'outputPath']
-        for key in list(yaml_data.keys()):
-            if key in output_keys:
-                del yaml_data[key]
-        
-        yaml_data['output_directory'] = new_output_dir
-        print(f"[+] Set output_directory: {new_output_dir}")
+        # Repeat logins usually keep the same folder - leave the file alone if the only
+        # output directory entry already points at it
+        output_entries = [entry.rstrip() for entry in _OUTPUT_DIR_LINE_RE.findall(text)]
+        if output_entries == [f"output_directory: {new_output_dir}"]:
+            log.info(f"[+] prep_seg.yaml already has output_directory: {new_output_dir}")
+            return True
         
-        with open(yaml_file, 'w') as f:
-            yaml.dump(yaml_data, f, default_flow_style=False, indent=2)
+        if os.environ.get('PREP_SEG_FULL_YAML', '0') == '1':
+            # Full parse/dump round trip (normalizes the whole file)
+            import yaml
+            # Prefer the libyaml-backed loader/dumper, fall back to pure Python if unavailable
+            try:
+                from yaml import CSafeLoader as _YamlLoader, CSafeDumper as _YamlDumper
+            except ImportError:
+                from yaml import SafeLoader as _YamlLoader, SafeDumper as _YamlDumper
+            
+            # Parse the text already read above instead of opening the file again;
+            # an empty file loads as None
+            yaml_data = yaml.load(text, Loader=_YamlLoader) or {}
+            
+            # Remove existing output directory entries
+            for key in list(yaml_data.keys()):
+                if key in OUTPUT_DIR_KEYS:
+                    del yaml_data[key]
+            
+            yaml_data['output_directory'] = new_output_dir
+            
+            # Same atomic temp-file swap as the line edit, a failed dump never truncates the config
+            write_text_atomic(yaml_file, yaml.dump(yaml_data, Dumper=_YamlDumper, default_flow_style=False, indent=2))
+        else:
+            # Only the output directory changes - edit those lines and leave the rest untouched
+            text = _OUTPUT_DIR_LINE_RE.sub('', text).rstrip('\n')
+            text += f"\noutput_directory: {new_output_dir}\n"
+            write_text_atomic(yaml_file, text)
         
-        print(f"[+] prep_seg.yaml updated successfully")
+        log.info(f"[+] Set output_directory: {new_output_dir}")
+        log.info(f"[+] prep_seg.yaml updated successfully")
         return True
         
     except Exception as e:
-        print(f"[X] Error updating prep_seg.yaml: {e}")
+        log.info(f"[X] Error updating prep_seg.yaml: {e}")
         return False
 
-def run_full_s3_workflow_test(bucket_name):
+def run_full_s3_workflow_test(bucket_name, s3_client=None, current_username=None):
     """
     Test the complete S3 workflow end-to-end
+    
+    Reuses s3_client and current_username when given, otherwise resolves them itself
     """
-    print("\n" + "="*60)
-    print("   RUNNING FULL S3 WORKFLOW TEST")
-    print("="*60)
+    log.info("\n" + "="*60)
+    log.info("   RUNNING FULL S3 WORKFLOW TEST")
+    log.info("="*60)
     
-    current_username = get_current_username()
-    print(f"[*] Testing as user: {current_username}")
+    if current_username is None:
+        current_username = get_current_username()
+    log.info(f"[*] Testing as user: {current_username}")
     
     # Step 1: Initialize S3 client
-    s3_client = initialize_s3_client(bucket_name)
+    if s3_client is None:
+        s3_client = initialize_s3_client(bucket_name)
     if not s3_client:
-        print("[X] S3 client initialization failed - cannot continue workflow test")
+        log.info("[X] S3 client initialization failed - cannot continue workflow test")
         return False
     
     # Step 2: List user folders
     user_folders = list_user_folders_s3(bucket_name, s3_client)
     if not user_folders:
-        print("[!] No user folders found - this may be expected for a new bucket")
+        log.info("[!] No user folders found - this may be expected for a new bucket")
         return True
     
     # Step 3: Test claiming and releasing a folder (using last folder to avoid conflicts)
     test_folder = user_folders[-1]
-    print(f"\n[*] Testing folder operations with: {test_folder}")
+    log.info(f"\n[*] Testing folder operations with: {test_folder}")
     
     # Check current status
     is_taken, taken_by = check_user_taken_s3(bucket_name, s3_client, test_folder)
     
     if is_taken and taken_by != current_username:
-        print(f"[*] Folder {test_folder} is taken by another user - skipping claim test")
+        log.info(f"[*] Folder {test_folder} is taken by another user - skipping claim test")
     else:
         # Try to claim it
         if claim_user_folder_s3(bucket_name, s3_client, test_folder, current_username):
-            print(f"[+] Successfully claimed {test_folder}")
+            log.info(f"[+] Successfully claimed {test_folder}")
             
             # Test sync
-            print(f"\n[*] Testing sync for {test_folder}")
+            log.info(f"\n[*] Testing sync for {test_folder}")
             local_dir = sync_s3_to_local(bucket_name, s3_client, test_folder)
-            print(f"[+] Sync test completed: {local_dir}")
+            log.info(f"[+] Sync test completed: {local_dir}")
         else:
-            print(f"[X] Failed to claim {test_folder}")
+            log.info(f"[X] Failed to claim {test_folder}")
             return False
     
-    print("\n[+] Full S3 workflow test completed successfully!")
+    log.info("\n[+] Full S3 workflow test completed successfully!")
     return True
 
-def find_and_assign_user(bucket_name):
+def find_local_assignment_hints(current_username):
+    """
+    Return local user folders whose taken_by.txt (folder, username, timestamp) names current_username
+    
+    These are only hints; the S3 marker is the source of truth
+    """
+    hinted_folders = []
+    try:
+        with os.scandir(APPSTREAM_ROOT) as entries:
+            for entry in entries:
+                if not (_is_user_folder(entry.name) and entry.is_dir(follow_symlinks=False)):
+                    continue
+                try:
+                    with open(os.path.join(entry.path, "taken_by.txt"), 'rb') as f:
+                        lines = f.read().decode('utf-8', 'replace').split('\n')
+                except FileNotFoundError:
+                    continue
+                if len(lines) > 1 and lines[1].strip().lower() == current_username:
+                    hinted_folders.append(entry.name)
+    except OSError:
+        pass  # No local user folders yet
+    return hinted_folders
+
+def assign_user_s3(bucket_name, s3_client, current_username):
+    """Find the current user's existing S3 folder, or claim the first available one"""
+    # Repeat logins: the local taken_by.txt names the folder, one HEAD confirms it
+    for user_folder in find_local_assignment_hints(current_username):
+        is_taken, taken_by_content = head_user_taken_s3(bucket_name, s3_client, user_folder)
+        if is_taken and taken_by_content.split('\n')[0].strip().lower() == current_username:
+            log.info(f"[+] Found existing assignment: {user_folder} for {current_username} (local hint)")
+            return user_folder
+    
+    # Warm runs: the folder set rarely changes, so a recent on-disk list replaces the
+    # listing. Marker state is not cached - every folder gets a live ownership check.
+    # Ownership results are shared between both passes, so a re-list only HEADs new folders
+    taken_status = {}
+    cached_folders = load_cached_user_folders(bucket_name)
+    if cached_folders:
+        log.info(f"[+] Using cached S3 user folder list ({len(cached_folders)} folders)")
+        assigned_user = pick_user_folder_s3(
+            bucket_name, s3_client, current_username, cached_folders, taken_status,
+            verify_exists=True
+        )
+        if assigned_user:
+            return assigned_user
+        log.info("[*] No folder available from the cached list - listing S3 again")
+    
+    # The CommonPrefixes listing costs the same however many files the user folders hold;
+    # ownership then comes from one concurrent HEAD round over the folders (asyncio via
+    # aiobotocore when installed). Per-folder LIST probes would add a request per folder.
+    user_folders = list_user_folders_s3(bucket_name, s3_client)
+    if not user_folders:
+        return None
+    save_cached_user_folders(bucket_name, user_folders)
+    
+    return pick_user_folder_s3(bucket_name, s3_client, current_username, user_folders, taken_status)
+
+def pick_user_folder_s3(bucket_name, s3_client, current_username, user_folders, taken_status=None,
+                        verify_exists=False):
+    """
+    Return the user's own folder among user_folders, or claim the first free one
+    
+    Ownership is checked with one concurrent HEAD round. taken_status is an optional
+    {user_folder: (is_taken, taken_by)} dict of earlier results; folders already in it are
+    not checked again, and it is updated with this round's results.
+    With verify_exists (user_folders from the cache), a free folder is claimed only if it
+    still exists in S3 - a missing marker also means a folder deleted since it was cached.
+    """
+    if taken_status is None:
+        taken_status = {}
+    taken_status.update(check_users_taken_bulk_s3(
+        bucket_name, s3_client,
+        [user_folder for user_folder in user_folders if user_folder not in taken_status]
+    ))
+    
+    # Single walk: stop at the user's own folder, otherwise remember the free ones in
+    # order so a lost claim race can move on to the next without rescanning
+    free_folders = []
+    for user_folder in user_folders:
+        is_taken, taken_by_content = taken_status[user_folder]
+        
+        if not is_taken:
+            free_folders.append(user_folder)
+        elif taken_by_content:
+            # Extract username from first line (S3 format: username only)
+            taken_by_user = taken_by_content.split('\n')[0].strip().lower()
+            if taken_by_user == current_username:
+                log.info(f"[+] Found existing assignment: {user_folder} for {current_username}")
+                return user_folder
+    
+    for user_folder in free_folders:
+        if verify_exists and not user_folder_exists_s3(bucket_name, s3_client, user_folder):
+            # Claiming would recreate a deleted folder holding only taken_by.txt
+            log.info(f"[!] Cached folder {user_folder} no longer exists in S3 - skipping")
+            continue
+        log.info(f"[+] Found available folder: {user_folder}")
+        if claim_user_folder_s3(bucket_name, s3_client, user_folder, current_username):
+            return user_folder
+        # Lost the race for it - another session owns it now
+        taken_status[user_folder] = (True, None)
+    
+    return None
+
+def run_in_daemon_thread(func, *args):
+    """
+    Run func(*args) on a daemon thread and return a Future for its result
+    
+    Unlike ThreadPoolExecutor workers, the thread is not joined at interpreter exit, so a
+    call stuck on a slow mount never holds up the batch file waiting for this process
+    """
+    future = Future()
+    
+    def run():
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+def find_and_assign_user(bucket_name, s3_client, current_username, mount_future=None):
     """
     Main function to find and assign user with special handling for test environment
+    
+    s3_client is the shared client from initialize_s3_client (None when S3 is unavailable).
+    mount_future is an already running check_s3_mount_available, started here if not given.
+    Returns (assigned_user, source) where source is "s3" or "mount", the backend to sync from.
     """
-    print("=" * 60)
-    print("   HYBRID S3/MOUNT USER ASSIGNMENT SYSTEM")
-    print("=" * 60)
-    print(f"Target bucket: {bucket_name}")
-    print("")
+    log.info("=" * 60)
+    log.info("   HYBRID S3/MOUNT USER ASSIGNMENT SYSTEM")
+    log.info("=" * 60)
+    log.info(f"Target bucket: {bucket_name}")
+    log.info("")
     
-    current_username = get_current_username()
-    print(f"[*] Current username: {current_username}")
+    log.info(f"[*] Current username: {current_username}")
     
     # Special handling for ImageBuilderTest - use mount-only workflow
     if current_username == 'imagebuildertest':
-        print("[*] Test environment detected - using mount-only workflow")
+        log.info("[*] Test environment detected - using mount-only workflow")
         
         # Check mount availability
         mount_path = check_s3_mount_available()
         if not mount_path:
-            print("[X] Mount not available for test environment")
-            return None
+            log.info("[X] Mount not available for test environment")
+            return None, None
         
-        # For test environment, first check if user is already assigned
-        print("Scanning mount for available user folders...")
-        user_folders = list_user_folders_mount(mount_path)
-
-        if user_folders:
-            assigned_user = None
-            
-            # First pass: check if current user already has an assignment
-            for user_folder in user_folders:
-                is_taken, taken_by_content = check_user_taken_mount(mount_path, user_folder)
-                
-                if is_taken and taken_by_content:
-                    # Extract username from first line (mount format: username only)
-                    taken_by_user = taken_by_content.split('\n')[0].strip().lower()
-                    if taken_by_user == current_username:
-                        print(f"[+] Found existing assignment: {user_folder} for {current_username}")
-                        assigned_user = user_folder
-                        print(f"[+] Test environment using existing assignment: {assigned_user}")
-                        break
-            
-            # Second pass: if no existing assignment, find available folder
-            if not assigned_user:
-                for user_folder in user_folders:
-                    is_taken, taken_by = check_user_taken_mount(mount_path, user_folder)
-                    
-                    if not is_taken:
-                        print(f"[+] Found available folder: {user_folder}")
-                        if claim_user_folder_mount(mount_path, user_folder, current_username):
-                            assigned_user = user_folder
-                            print(f"[+] Test environment assigned to: {assigned_user}")
-                            break
-        
-        return assigned_user
+        # For test environment, reuse an existing assignment or claim a free folder
+        assigned_user = assign_user_mount(mount_path, current_username)
+        if assigned_user:
+            log.info(f"[+] Test environment assigned to: {assigned_user}")
+        
+        return assigned_user, "mount"
     
     # Production workflow - try S3 first, then mount fallback
-    print("\n" + "-" * 40)
-    print("Attempting S3 connection...")
-    s3_client = initialize_s3_client(bucket_name)
-
-    assigned_user = None
+    # Locate the mount in the background while S3 is tried, so the fallback does not start
+    # from scratch after a slow S3 failure. Only this cheap check runs early; the per-folder
+    # probe and any claim happen below once S3 produced no assignment.
+    if mount_future is None:
+        mount_future = run_in_daemon_thread(check_s3_mount_available)
     
     if s3_client is not None:
         # S3 available - use S3 workflow
-        print("Using S3 workflow...")
-        user_folders = list_user_folders_s3(bucket_name, s3_client)
-
-        if user_folders:
-            # First pass: check if current user already has an assignment
-            for user_folder in user_folders:
-                is_taken, taken_by_content = check_user_taken_s3(bucket_name, s3_client, user_folder)
-                
-                if is_taken and taken_by_content:
-                    # Extract username from first line (S3 format: username only)
-                    taken_by_user = taken_by_content.split('\n')[0].strip().lower()
-                    if taken_by_user == current_username:
-                        print(f"[+] Found existing assignment: {user_folder} for {current_username}")
-                        assigned_user = user_folder
-                        break
-            
-            # Second pass: if no existing assignment, find available folder
-            if not assigned_user:
-                for user_folder in user_folders:
-                    is_taken, taken_by = check_user_taken_s3(bucket_name, s3_client, user_folder)
-                    
-                    if not is_taken:
-                        print(f"[+] Found available folder: {user_folder}")
-                        if claim_user_folder_s3(bucket_name, s3_client, user_folder, current_username):
-                            assigned_user = user_folder
-                            break
-        
-        if not assigned_user:
-            print("[X] No available user folders found in S3")
+        log.info("Using S3 workflow...")
+        assigned_user = assign_user_s3(bucket_name, s3_client, current_username)
+        
+        if assigned_user:
+            return assigned_user, "s3"
+        log.info("[X] No available user folders found in S3")
     
     # Fallback to mounted S3 if S3 direct access failed
-    if not assigned_user:
-        print("\n" + "-" * 40)
-        print("Attempting mount fallback...")
-        mount_path = check_s3_mount_available()
-        
-        if mount_path:
-            print("Using mount workflow...")
-            user_folders = list_user_folders_mount(mount_path)
-            
-            if user_folders:
-                assigned_user = None
-                # First pass: check if current user already has an assignment
-                for user_folder in user_folders:
-                    is_taken, taken_by_content = check_user_taken_mount(mount_path, user_folder)
-                    
-                    if is_taken and taken_by_content:
-                        # Extract username from first line (mount format: username only)
-                        taken_by_user = taken_by_content.split('\n')[0].strip().lower()
-                        if taken_by_user == current_username:
-                            print(f"[+] Found existing assignment: {user_folder} for {current_username}")
-                            assigned_user = user_folder
-                            break
-                
-                # Second pass: if no existing assignment, find available folder
-                if not assigned_user:
-                    for user_folder in user_folders:
-                        is_taken, taken_by = check_user_taken_mount(mount_path, user_folder)
-                        
-                        if not is_taken:
-                            print(f"[+] Found available folder: {user_folder}")
-                            if claim_user_folder_mount(mount_path, user_folder, current_username):
-                                assigned_user = user_folder
-                                break
+    log.info("\n" + "-" * 40)
+    log.info("Attempting mount fallback...")
+    mount_path = mount_future.result()
+    
+    if mount_path:
+        log.info("Using mount workflow...")
+        assigned_user = assign_user_mount(mount_path, current_username)
+        if assigned_user:
+            return assigned_user, "mount"
     
     # Final fallback - generate user assignment
-    if not assigned_user:
-        print("\n" + "-" * 40)
-        print("No user folders available - cannot assign user")
-        print("[X] No user{i} folders found in S3 or mount")
-        print("[DEBUG] Make sure your S3 bucket or mount contains folders like: user1, user2, user3, etc.")
-        return None 
+    log.info("\n" + "-" * 40)
+    log.info("No user folders available - cannot assign user")
+    log.info("[X] No user{i} folders found in S3 or mount")
+    log.debug("[DEBUG] Make sure your S3 bucket or mount contains folders like: user1, user2, user3, etc.")
+    return None, None
+
+class _BufferedStreamHandler(logging.StreamHandler):
+    """StreamHandler that leaves flushing to the stream's own buffer"""
     
-    return assigned_user
+    def flush(self):
+        pass
+
+def configure_logging():
+    """Log plain messages to stdout, batching the console writes"""
+    # Every console write blocks on AppStream, so stdout is flushed at exit
+    # (or when its buffer fills) instead of once per line
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=False)
+    handler = _BufferedStreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    # Only this script's logger - the root logger stays unconfigured so botocore, s3transfer
+    # and urllib3 records (credential lookups, wire-level debug) stay off stdout
+    log.addHandler(handler)
+    log.propagate = False
+    # LOG_LEVEL=DEBUG brings back the [DEBUG] diagnostics; unknown names fall back to INFO
+    level = logging.getLevelName(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    log.setLevel(level if isinstance(level, int) else logging.INFO)
 
 if __name__ == "__main__":
+    configure_logging()
 
+    # Resolved once per run and shared by assignment and sync
     current_username = get_current_username()
-    print(f"[DEBUG] Detected username: '{current_username}'")
-    print(f"[DEBUG] Username type: {type(current_username)}")
-    print(f"[DEBUG] Is imagebuildertest?: {current_username == 'imagebuildertest'}")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"[DEBUG] Detected username: '{current_username}'")
+        log.debug(f"[DEBUG] Username type: {type(current_username)}")
+        log.debug(f"[DEBUG] Is imagebuildertest?: {current_username == 'imagebuildertest'}")
     
     BUCKET_NAME = "hoda2-ibd-sample-cases-us-west-2"
     
-    # Optional comprehensive S3 testing (only for production users)
-    test_mode = os.environ.get('RUN_S3_TESTS', '0')
-    if test_mode == '1' and current_username != 'imagebuildertest':
-        print("\n" + "="*60)
-        print("   S3 COMPREHENSIVE TESTING MODE")
-        print("="*60)
-        
-        if run_full_s3_workflow_test(BUCKET_NAME):
-            print("[+] All S3 tests passed - proceeding with normal execution")
+    # Build the S3 client once and reuse it for testing, assignment and sync
+    s3_client = None
+    mount_future = None
+    if current_username != 'imagebuildertest':
+        # Check for the mount while S3 is probed, so a host without S3 access does not pay
+        # for the two checks one after the other
+        mount_future = run_in_daemon_thread(check_s3_mount_available)
+        log.info("\n" + "-" * 40)
+        log.info("Attempting S3 connection...")
+        s3_client = initialize_s3_client(BUCKET_NAME)
+    
+    # Optional comprehensive S3 testing (only for production users). Without a client the
+    # test could only fail, so it is skipped instead of re-running initialization
+    test_mode = os.environ.get('RUN_S3_TESTS', '0') == '1' and current_username != 'imagebuildertest'
+    if test_mode and s3_client is None:
+        log.info("[!] S3 unavailable - skipping comprehensive S3 tests")
+    elif test_mode:
+        log.info("\n" + "="*60)
+        log.info("   S3 COMPREHENSIVE TESTING MODE")
+        log.info("="*60)
+        
+        if run_full_s3_workflow_test(BUCKET_NAME, s3_client, current_username):
+            log.info("[+] All S3 tests passed - proceeding with normal execution")
         else:
-            print("[X] S3 tests failed - check permissions and configuration")
+            log.info("[X] S3 tests failed - check permissions and configuration")
             # Continue anyway but warn user
-            print("[!] Continuing with normal execution despite test failures...")
+            log.info("[!] Continuing with normal execution despite test failures...")
         
-        print("\n" + "="*60)
-        print("   STARTING NORMAL EXECUTION")
-        print("="*60)
+        log.info("\n" + "="*60)
+        log.info("   STARTING NORMAL EXECUTION")
+        log.info("="*60)
     
     try:
-        assigned_user = find_and_assign_user(BUCKET_NAME)
+        assigned_user, assigned_source = find_and_assign_user(BUCKET_NAME, s3_client, current_username, mount_future)
         
         if assigned_user:
-            print("\n" + "=" * 60)
-            print("   ASSIGNMENT COMPLETED")
-            print("=" * 60)
-            print(f"[+] Assigned user: {assigned_user}")
+            log.info("\n" + "=" * 60)
+            log.info("   ASSIGNMENT COMPLETED")
+            log.info("=" * 60)
+            log.info(f"[+] Assigned user: {assigned_user}")
             
-            current_username = get_current_username()
+            # prep_seg.yaml only needs the folder name, so rewrite it while the sync runs.
+            # Daemon thread: after the timeout below the process really does exit without it
+            # (the temp-file swap means an abandoned rewrite leaves the old config intact)
+            yaml_future = run_in_daemon_thread(update_prep_seg_yaml, assigned_user)
             
             # Special sync handling for test environment
             if current_username == 'imagebuildertest':
-                print("\n" + "-" * 40)
-                print("Test environment - syncing from mount only...")
+                log.info("\n" + "-" * 40)
+                log.info("Test environment - syncing from mount only...")
                 mount_path = check_s3_mount_available()
                 if mount_path:
                     source_dir = mount_path / assigned_user
                     local_dir = sync_mount_to_local_from_path(source_dir, assigned_user)
-                    print(f"[+] Test user data synced from mount: {local_dir}")
+                    log.info(f"[+] Test user data synced from mount: {local_dir}")
                 else:
-                    print("[!] Mount not available for test environment")
-                    local_dir = Path(f"C:/AppStreamUsers/{assigned_user}")
-                    local_dir.mkdir(parents=True, exist_ok=True)
+                    log.info("[!] Mount not available for test environment")
+                    local_dir = APPSTREAM_ROOT / assigned_user
+                    ensure_dir(local_dir)
             else:
-                # Production sync - try S3 first, then mount fallback
-                s3_client = initialize_s3_client(BUCKET_NAME)
-                if s3_client is not None:
-                    print("\n" + "-" * 40)
-                    print("Syncing from S3...")
+                # Production sync - from the backend that made the assignment, so a mount
+                # assignment after an S3 failure is not synced from the failing S3
+                if assigned_source == "s3":
+                    log.info("\n" + "-" * 40)
+                    log.info("Syncing from S3...")
                     local_dir = sync_s3_to_local(BUCKET_NAME, s3_client, assigned_user)
                 else:
                     mount_path = check_s3_mount_available()
                     if mount_path:
-                        print("\n" + "-" * 40)
-                        print("Syncing from mount...")
+                        log.info("\n" + "-" * 40)
+                        log.info("Syncing from mount...")
                         source_dir = mount_path / assigned_user
                         local_dir = sync_mount_to_local_from_path(source_dir, assigned_user)
                     else:
-                        print("[!] Neither S3 nor mount available - creating empty user dir")
-                        local_dir = Path(f"C:/AppStreamUsers/{assigned_user}")
-                        local_dir.mkdir(parents=True, exist_ok=True)
+                        log.info("[!] Neither S3 nor mount available - creating empty user dir")
+                        local_dir = APPSTREAM_ROOT / assigned_user
+                        ensure_dir(local_dir)
             
-            # Update configuration
-            if update_prep_seg_yaml(assigned_user):
-                print(f"[+] Configuration updated for user folder: {assigned_user}")
+            # Configuration update started before the sync
+            try:
+                if yaml_future.result(timeout=30):
+                    log.info(f"[+] Configuration updated for user folder: {assigned_user}")
+            except FutureTimeoutError:
+                log.info("[!] prep_seg.yaml update still running after 30s - continuing without it")
             
             # Output for batch parsing
             print(f"\nASSIGNED_USER={assigned_user}")
-            print(f"USER_HOME_DIR=C:/AppStreamUsers/{assigned_user}")
+            print(f"USER_HOME_DIR={(APPSTREAM_ROOT / assigned_user).as_posix()}")
             
         else:
-            print("\n[X] Failed to assign user")
+            log.info("\n[X] Failed to assign user")
             sys.exit(1)
         
     except Exception as e:
-        print(f"\n[X] Unexpected error: {e}")
+        log.info(f"\n[X] Unexpected error: {e}")
         import traceback
-        print("[DEBUG] Full traceback:")
+        log.info("[DEBUG] Full traceback:")
+        sys.stdout.flush()
         traceback.print_exc()
         sys.exit(1)
\ No newline at end of file